@@ -1,19 +1,37 @@
 import os
+import io
 import gzip
 import tarfile
 import ftplib
 import numpy as np
-import matplotlib.pyplot as plt
-import matplotlib.colors as mcolors
-from datetime import datetime
+import cv2
+from datetime import datetime, timedelta
 import streamlit as st
 import tempfile
 import time
 import struct
-from scipy import ndimage
+import hashlib
+import shutil
 from PIL import Image, ImageDraw, ImageFont
 import warnings
-import shutil
+import threading
+import queue
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import deflate
+except ImportError:
+    deflate = None
+
+try:
+    import rapidgzip
+except ImportError:
+    rapidgzip = None
+
+try:
+    import numba
+except ImportError:
+    numba = None
 
 # Constants
 FTP_HOST = "gms.cr.chiba-u.ac.jp"
@@ -22,6 +40,37 @@ GMS5_END_DATE = datetime(2003, 5, 22, 0)
 GOES9_START_DATE = datetime(2003, 5, 22, 1)
 GOES9_END_DATE = datetime(2005, 6, 28, 2)
 VERTICAL_STRETCH = 1.35
+HORIZONTAL_STRETCH = 1.75
+# Output size of the original 12x10 in, 300 dpi matplotlib figure, which the
+# watermark font size and bottom offset were chosen for
+OUTPUT_MAX_WIDTH = 2994
+OUTPUT_MAX_HEIGHT = 2310
+WATERMARK_FONT_SIZE = 50
+WATERMARK_BOTTOM_OFFSET = 70
+FTP_BLOCK_SIZE = 1 << 20
+FTP_PARALLEL_STREAMS = 4
+FTP_MIN_RANGE_SIZE = 16 << 20
+COPY_BLOCK_SIZE = 1 << 20
+PREFETCH_MAX_QUEUED = 4
+CACHE_DIR = os.path.join(tempfile.gettempdir(), "sekaicache")
+CACHE_MAX_BYTES = 2 << 30
+# How long fetch and render results stay in the in-memory caches, in seconds
+CACHE_TTL = 3600
+# Part of the rendered-image cache key; bump it whenever the rendered output changes
+RENDER_VERSION = 8
+# Stretch calibrated temperatures as float32 and bin them afterwards, rather
+# than binning first and stretching the uint8 colormap indices
+RENDER_FLOAT_STRETCH = False
+TEMPERATURE_MIN_C = -100
+TEMPERATURE_MAX_C = 40
+MANUAL_SCALE_FACTOR = (320.0 - 180.0) / 255.0
+MANUAL_ADD_OFFSET = 180.0
+# Every IR1 image in the archive is on the same fixed grid behind a fixed-size header
+IMG_HEADER_SIZE = 352
+IMAGE_WIDTH = IMAGE_HEIGHT = 2366
+
+# Some OpenCV builds default to fewer threads than there are cores
+cv2.setNumThreads(max(1, os.cpu_count() or 1))
 
 def comprehensive_patch_gms5_reader():
     """Comprehensive patch for GMS5 reader to handle historical file variants"""
@@ -39,9 +88,10 @@ def comprehensive_patch_gms5_reader():
         def safe_read_from_file_obj(file_obj, dtype, count, offset=0):
             """Safe version of read_from_file_obj that handles buffer size issues"""
             file_obj.seek(offset)
-            remaining_data = file_obj.read()
-            actual_bytes = len(remaining_data)
             bytes_needed = dtype.itemsize * count
+            # Read only what is needed rather than the rest of the file plus a trimmed copy
+            remaining_data = file_obj.read(bytes_needed)
+            actual_bytes = len(remaining_data)
 
             if actual_bytes < bytes_needed:
                 actual_count = actual_bytes // dtype.itemsize
@@ -49,7 +99,6 @@ def comprehensive_patch_gms5_reader():
                     raise ValueError(f"Not enough data to read even one record of type {dtype}")
             else:
                 actual_count = count
-                remaining_data = remaining_data[:bytes_needed]
 
             return np.frombuffer(remaining_data, dtype=dtype, count=actual_count)
 
@@ -90,7 +139,7 @@ def comprehensive_patch_gms5_reader():
             try:
                 _, nominal_pixels = self._get_nominal_shape()
             except:
-                nominal_pixels = 2366
+                nominal_pixels = IMAGE_WIDTH
 
             specs = self._get_image_data_type_specs()
             file_size = os.path.getsize(self._filename)
@@ -117,160 +166,601 @@ def comprehensive_patch_gms5_reader():
     except ImportError:
         st.warning("Satpy not available - will use manual reading only")
 
-def create_colormap():
-    """Create custom satellite colormap"""
-    return mcolors.LinearSegmentedColormap.from_list("", [
+def create_colormap(n=256):
+    """Create custom satellite colormap as an (n, 3) uint8 RGB table
+
+    Samples the reversed color stops the same way matplotlib's
+    LinearSegmentedColormap.from_list(...).reversed() builds its table, where a
+    repeated position marks a hard color break.
+    """
+    stops = [
         (0 / 140, "#000000"), (60 / 140, "#fffdfd"), (60 / 140, "#05fcfe"),
         (70 / 140, "#010071"), (80 / 140, "#00fe24"), (90 / 140, "#fbff2d"),
         (100 / 140, "#fd1917"), (110 / 140, "#000300"), (120 / 140, "#e1e4e5"),
         (120 / 140, "#eb6fc0"), (130 / 140, "#9b1f94"), (140 / 140, "#330f2f")
-    ]).reversed()
+    ]
+    positions = np.array([1.0 - position for position, _ in reversed(stops)]) * (n - 1)
+    colors = np.array([
+        [int(color[i:i + 2], 16) / 255 for i in (1, 3, 5)] for _, color in reversed(stops)
+    ])
+
+    samples = (n - 1) * np.linspace(0, 1, n)[1:-1]
+    upper = np.searchsorted(positions, samples)
+    weight = ((samples - positions[upper - 1]) / (positions[upper] - positions[upper - 1]))[:, None]
+    table = np.vstack([
+        colors[0],
+        weight * (colors[upper] - colors[upper - 1]) + colors[upper - 1],
+        colors[-1],
+    ])
+    return (table * 255).astype(np.uint8)
+
+@st.cache_resource
+def build_colormap_luts():
+    """Build the colormap lookup tables once per process: one indexed by the
+    colormap's own bins for calibrated data, one indexed by raw counts from
+    manual reading"""
+    colormap_lut = create_colormap()
+    n = len(colormap_lut)
+    count_temperatures_c = np.arange(256, dtype=np.float32) * MANUAL_SCALE_FACTOR + MANUAL_ADD_OFFSET - 273.15
+    norm = np.clip((count_temperatures_c - TEMPERATURE_MIN_C) / (TEMPERATURE_MAX_C - TEMPERATURE_MIN_C), 0, 1)
+    # Bin like a colormap lookup: floor(norm * n), with norm == 1 in the last bin
+    counts_lut = colormap_lut[np.minimum((norm * n).astype(np.intp), n - 1)]
+    return colormap_lut, counts_lut
+
+COLORMAP_LUT, COUNTS_LUT = build_colormap_luts()
+
+if numba is not None:
+    @numba.njit(parallel=True, cache=True)
+    def lut_map(indices, lut, out):
+        """Gather RGB colors for a 2-D uint8 index image into out, one row per thread"""
+        for i in numba.prange(indices.shape[0]):
+            for j in range(indices.shape[1]):
+                v = indices[i, j]
+                out[i, j, 0] = lut[v, 0]
+                out[i, j, 1] = lut[v, 1]
+                out[i, j, 2] = lut[v, 2]
+else:
+    def lut_map(indices, lut, out):
+        """Gather RGB colors for a 2-D uint8 index image into out"""
+        np.take(lut, indices, axis=0, out=out)
+
+if numba is not None:
+    @numba.njit(parallel=True, cache=True)
+    def bin_temperatures(values, offset, scale, top, out):
+        """Kelvin -> clipped colormap bin for a 2-D image into out, one row per thread"""
+        for i in numba.prange(values.shape[0]):
+            for j in range(values.shape[1]):
+                v = (values[i, j] - offset) * scale
+                # Written so NaN pixels land in the first bin
+                if not v > 0:
+                    v = 0
+                elif v > top:
+                    v = top
+                out[i, j] = np.uint8(v)
+else:
+    def bin_temperatures(values, offset, scale, top, out):
+        """Kelvin -> clipped colormap bin for a 2-D image into out"""
+        scaled = np.subtract(values, offset, dtype=np.float32)
+        scaled *= scale
+        # NaN pixels go to the first bin, as in the Numba kernel
+        np.nan_to_num(scaled, copy=False, nan=0.0)
+        np.clip(scaled, 0, top, out=scaled)
+        np.copyto(out, scaled, casting='unsafe')
+
+def temperatures_to_indices(values):
+    """Bin a Kelvin image onto the colormap's own table as uint8 indices"""
+    indices = np.empty(values.shape, dtype=np.uint8)
+    bin_temperatures(
+        values,
+        273.15 + TEMPERATURE_MIN_C,
+        len(COLORMAP_LUT) / (TEMPERATURE_MAX_C - TEMPERATURE_MIN_C),
+        len(COLORMAP_LUT) - 1,
+        indices,
+    )
+    return indices
+
+def apply_lut(indices, lut):
+    """Color a 2-D uint8 index image through an RGB lookup table"""
+    rgb_values = np.empty(indices.shape + (3,), dtype=np.uint8)
+    lut_map(indices, lut, rgb_values)
+    return rgb_values
+
+@st.cache_resource
+def load_font(size=WATERMARK_FONT_SIZE):
+    """Load the watermark font once per process, falling back to DejaVu Sans
+    and then Pillow's default"""
+    for font_name in ("arial.ttf", "DejaVuSans.ttf"):
+        try:
+            return ImageFont.truetype(font_name, size)
+        except OSError:
+            pass
+    return ImageFont.load_default()
 
 def try_manual_reading(file_path, year, month, day, hour):
     """Fallback manual reading method if Satpy fails"""
     try:
-        with open(file_path, 'rb') as f:
-            data = f.read()
+        width, height = IMAGE_WIDTH, IMAGE_HEIGHT
+        if os.path.getsize(file_path) <= IMG_HEADER_SIZE:
+            raise ValueError("Insufficient data in file")
 
-        # Try to extract dimensions from header
-        if len(data) > 12:
-            try:
-                width = struct.unpack('>H', data[8:10])[0]
-                height = struct.unpack('>H', data[10:12])[0]
-                if width > 5000 or height > 5000 or width < 100 or height < 100:
-                    width = 2366
-                    height = 2366
-            except:
-                width = 2366
-                height = 2366
+        # Map the image data instead of reading it, so pages are only loaded
+        # as the stretch touches them
+        image_array = np.memmap(file_path, dtype=np.uint8, mode='r', offset=IMG_HEADER_SIZE)
+        available_pixels = min(len(image_array), width * height)
+
+        if available_pixels == width * height:
+            image = image_array[:available_pixels].reshape(height, width)
         else:
-            width = 2366
-            height = 2366
-
-        # Skip header and get image data
-        header_size = 352
-        if len(data) > header_size:
-            image_data = data[header_size:]
-            image_array = np.frombuffer(image_data, dtype=np.uint8)
-
-            available_pixels = len(image_array)
-            target_pixels = width * height
-            
-            if available_pixels >= target_pixels:
-                image = image_array[:target_pixels].reshape(height, width)
+            height = available_pixels // width
+            if height < 100:
+                side = int(np.sqrt(available_pixels))
+                width = height = side
+                image = image_array[:side*side].reshape(height, width)
             else:
-                height = available_pixels // width
-                if height < 100:
-                    side = int(np.sqrt(available_pixels))
-                    width = height = side
-                    image = image_array[:side*side].reshape(height, width)
-                else:
-                    image = image_array[:height * width].reshape(height, width)
-
-            # Convert to temperature (approximated calibration)
-            temperature = 180.0 + (image.astype(np.float32) / 255.0) * (320.0 - 180.0)
-
-            # Create xarray DataArray to mimic Satpy output
-            import xarray as xr
-            ir1_data = xr.DataArray(
-                temperature,
-                dims=['y', 'x'],
-                attrs={
-                    'platform': 'GMS-5',
-                    'sensor': 'VISSR',
-                    'units': 'K',
-                    'standard_name': 'brightness_temperature',
-                    'start_time': datetime(year, month, day, hour),
-                }
-            )
-            return ir1_data
-        else:
-            raise ValueError("Insufficient data in file")
+                image = image_array[:height * width].reshape(height, width)
+
+        # Create xarray DataArray to mimic Satpy output. The raw counts are kept
+        # as uint8 and carry their (approximated) calibration as CF-style
+        # scale_factor/add_offset, so they can be stretched before conversion
+        import xarray as xr
+        ir1_data = xr.DataArray(
+            image,
+            dims=['y', 'x'],
+            attrs={
+                'platform': 'GMS-5',
+                'sensor': 'VISSR',
+                'units': 'K',
+                'standard_name': 'brightness_temperature',
+                'start_time': datetime(year, month, day, hour),
+                'scale_factor': MANUAL_SCALE_FACTOR,
+                'add_offset': MANUAL_ADD_OFFSET,
+            }
+        )
+        return ir1_data
 
     except Exception as e:
         print(f"Manual reading failed: {e}")
         return None
 
-@st.cache_data(ttl=3600)
-def fetch_file(year, month, day, hour):
-    """Fetch satellite file from FTP server"""
-    temp_dir = tempfile.mkdtemp()
-    
+class FetchCancelled(Exception):
+    """Raised inside fetch_file when the request that started it has gone away"""
+
+def gunzip(data):
+    """Decompress a gzip payload, using libdeflate or rapidgzip when available"""
+    if deflate is not None:
+        try:
+            return deflate.gzip_decompress(data)
+        except deflate.DeflateError:
+            pass
+    if rapidgzip is not None:
+        with rapidgzip.open(io.BytesIO(data), parallelization=os.cpu_count() or 1) as f_in:
+            return f_in.read()
+    return gzip.decompress(data)
+
+@st.cache_resource
+def get_ftp_pool():
+    """Idle logged-in FTP connections shared by all fetches"""
+    return queue.LifoQueue()
+
+def connect_ftp():
+    """Open a logged-in FTP connection in passive mode"""
+    ftp = ftplib.FTP(FTP_HOST, timeout=30)
+    ftp.login()
+    ftp.set_pasv(True)
+    return ftp
+
+def acquire_ftp():
+    """Take a live connection from the pool, or open a new one"""
+    pool = get_ftp_pool()
+    while True:
+        try:
+            ftp = pool.get_nowait()
+        except queue.Empty:
+            return connect_ftp()
+
+        # The server drops idle sessions, so check before reusing one
+        try:
+            ftp.voidcmd("NOOP")
+            return ftp
+        except ftplib.all_errors:
+            ftp.close()
+
+def release_ftp(ftp):
+    """Return a connection to the pool for the next fetch, unless it has been
+    closed because its session could not be trusted"""
+    if ftp.sock is not None:
+        get_ftp_pool().put(ftp)
+
+def download_to_pipe(ftp, file_name, write_fd, cancel=None):
+    """Download a file into the write end of a pipe, returns the byte count
+
+    Files the server reports as large are fetched as parallel byte ranges when
+    it allows the extra connections, anything else as a single stream. The
+    pipe is closed however this returns, so the reader always sees the end of
+    the data.
+    """
+    pipe_out = os.fdopen(write_fd, 'wb')
     try:
-        request_time = datetime(year, month, day, hour)
+        try:
+            ftp.voidcmd("TYPE I")
+            size = ftp.size(file_name)
+            directory = ftp.pwd()
+        except ftplib.Error:
+            size = None
 
-        if request_time < GMS5_START_DATE or request_time > GOES9_END_DATE:
-            return None, None, "The requested date is out of this dataset's period of coverage!"
+        streams = min(FTP_PARALLEL_STREAMS, (size or 0) // FTP_MIN_RANGE_SIZE)
+        if streams > 1:
+            range_ftps = open_range_connections(directory, streams - 1)
+            if range_ftps:
+                return download_ranges_to_pipe(ftp, range_ftps, file_name, size, pipe_out, cancel)
+        return download_stream_to_pipe(ftp, file_name, pipe_out, cancel)
+    finally:
+        try:
+            pipe_out.close()
+        except BrokenPipeError:
+            # The reader closed its end early and does not need the rest
+            pass
+
+def open_range_connections(directory, count):
+    """Take count more connections in directory for a ranged download, returns
+    an empty list if the server will not allow that many or does not support
+    REST"""
+    def open_range_connection():
+        range_ftp = acquire_ftp()
+        try:
+            range_ftp.cwd(directory)
+            range_ftp.voidcmd("TYPE I")
+            # Not every server implements REST, which the ranges rely on
+            range_ftp.sendcmd("REST 0")
+        except BaseException:
+            range_ftp.close()
+            raise
+        return range_ftp
+
+    with ThreadPoolExecutor(max_workers=count) as executor:
+        attempts = [executor.submit(open_range_connection) for _ in range(count)]
 
-        if GMS5_START_DATE <= request_time <= GMS5_END_DATE:
-            ftp_base_path = "/pub/GMS5/VISSR"
-            satellite = "GMS5"
-        elif GOES9_START_DATE <= request_time <= GOES9_END_DATE:
-            ftp_base_path = "/pub/GOES9-Pacific/VISSR"
-            satellite = "GOES9"
+    range_ftps = [attempt.result() for attempt in attempts if attempt.exception() is None]
+    if len(range_ftps) < count:
+        # e.g. "421 Too many connections" or "502 Command not implemented", a
+        # single stream still works
+        for range_ftp in range_ftps:
+            release_ftp(range_ftp)
+        return []
+    return range_ftps
+
+def retrieve_range(ftp, file_name, offset, length, callback, should_stop):
+    """Download length bytes of a file starting at offset, passing each block to
+    callback, returns the byte count
+
+    The data connection is closed as soon as the range is complete, which cuts
+    the RETR short unless the range runs to the end of the file. Servers
+    answer a cut-short RETR in different ways, so if the reply is not a clean
+    one the session is closed rather than reused.
+    """
+    received = 0
+    reached_end = False
+
+    conn = ftp.transfercmd(f"RETR {file_name}", rest=offset or None)
+    try:
+        with conn:
+            while received < length and not should_stop():
+                block = conn.recv(min(FTP_BLOCK_SIZE, length - received))
+                if not block:
+                    reached_end = True
+                    break
+                callback(block)
+                received += len(block)
+    finally:
+        if reached_end:
+            ftp.voidresp()
         else:
+            try:
+                ftp.voidresp()
+            except ftplib.error_temp:
+                # The usual "426 Transfer aborted"
+                pass
+            except ftplib.all_errors:
+                ftp.close()
+
+    if received < length and not should_stop():
+        raise EOFError(f"Transfer ended {length - received} bytes short of the range at {offset}")
+    return received
+
+def download_ranges_to_pipe(ftp, range_ftps, file_name, size, pipe_out, cancel=None):
+    """Download a file as one byte range per connection, returns the byte count
+
+    The first range streams straight into the pipe over ftp while the others
+    download concurrently over range_ftps into temporary files, which are then
+    copied to the pipe in order. When the reader closes the pipe early, every
+    range still in flight is aborted and its errors ignored. The extra
+    connections go back to the pool afterwards, unless their range failed.
+    """
+    range_size = -(-size // (len(range_ftps) + 1))
+    stop = threading.Event()
+    fetches = {}
+    bytes_downloaded = 0
+
+    def should_stop():
+        return stop.is_set() or (cancel is not None and cancel.is_set())
+
+    def write_block(block):
+        nonlocal bytes_downloaded
+        pipe_out.write(block)
+        bytes_downloaded += len(block)
+
+    def fetch_range(range_ftp, offset):
+        spool = tempfile.TemporaryFile()
+        try:
+            retrieve_range(
+                range_ftp, file_name, offset, min(range_size, size - offset), spool.write, should_stop
+            )
+        except BaseException:
+            spool.close()
+            raise
+        spool.seek(0)
+        return spool
+
+    try:
+        with ThreadPoolExecutor(max_workers=len(range_ftps)) as executor:
+            for range_ftp, offset in zip(range_ftps, range(range_size, size, range_size)):
+                fetches[range_ftp] = executor.submit(fetch_range, range_ftp, offset)
+
+            try:
+                retrieve_range(ftp, file_name, 0, range_size, write_block, should_stop)
+                for fetch in fetches.values():
+                    with fetch.result() as spool:
+                        while not should_stop():
+                            block = spool.read(COPY_BLOCK_SIZE)
+                            if not block:
+                                break
+                            write_block(block)
+            except BrokenPipeError:
+                # The reader found what it needed and closed its end early
+                pass
+            finally:
+                stop.set()
+
+        if cancel is not None and cancel.is_set():
+            raise FetchCancelled("Download cancelled")
+    except ftplib.error_perm as e:
+        # SIZE already found the file, so this must not read as a missing one
+        raise ftplib.error_reply(f"Ranged download failed: {e}") from e
+    finally:
+        for range_ftp in range_ftps:
+            fetch = fetches.get(range_ftp)
+            if fetch is not None and fetch.exception() is not None:
+                range_ftp.close()
+                continue
+            if fetch is not None:
+                fetch.result().close()
+            release_ftp(range_ftp)
+
+    return bytes_downloaded
+
+def download_stream_to_pipe(ftp, file_name, pipe_out, cancel=None):
+    """Stream an FTP download into a pipe, returns the byte count
+
+    If the reader closes the pipe early the RETR is cut short, and the server's
+    reply to it is consumed so the session can be reused.
+    """
+    bytes_downloaded = 0
+    transfer_complete = False
+
+    def write_block(block):
+        nonlocal bytes_downloaded
+        if cancel is not None and cancel.is_set():
+            raise FetchCancelled("Download cancelled")
+        pipe_out.write(block)
+        bytes_downloaded += len(block)
+
+    try:
+        try:
+            ftp.retrbinary(f"RETR {file_name}", write_block, blocksize=FTP_BLOCK_SIZE)
+        except (OSError, ftplib.error_temp) as e:
+            # If no data connection could be opened in passive mode (e.g.
+            # "425 Can't open data connection"), retry once in active mode
+            if isinstance(e, BrokenPipeError) or bytes_downloaded or not ftp.passiveserver:
+                raise
+            ftp.set_pasv(False)
+            try:
+                ftp.retrbinary(f"RETR {file_name}", write_block, blocksize=FTP_BLOCK_SIZE)
+            finally:
+                # Hand the session back to the pool in passive mode, so later
+                # fetches try that first again
+                ftp.set_pasv(True)
+        transfer_complete = True
+    except (BrokenPipeError, FetchCancelled):
+        # Either the reader found what it needed and closed its end early, or
+        # the request was cancelled. Consume the server's reply to the
+        # cut-short RETR to keep the session in sync
+        if not transfer_complete:
+            try:
+                ftp.voidresp()
+            except ftplib.all_errors:
+                pass
+        if cancel is not None and cancel.is_set():
+            raise FetchCancelled("Download cancelled")
+
+    return bytes_downloaded
+
+def write_atomically(path, data):
+    """Write a cache file under a temporary name and move it into place, so a
+    failed request never leaves a truncated file behind
+
+    data is either a bytes-like object or a readable file object, which is
+    copied across in large blocks without holding all of it in memory.
+    """
+    partial_path = f"{path}.{threading.get_ident()}.part"
+    try:
+        with open(partial_path, 'wb') as f_out:
+            if hasattr(data, 'read'):
+                shutil.copyfileobj(data, f_out, length=COPY_BLOCK_SIZE)
+            else:
+                f_out.write(data)
+        os.replace(partial_path, path)
+    except BaseException:
+        try:
+            os.remove(partial_path)
+        except OSError:
+            pass
+        raise
+
+    prune_cache()
+
+def prune_cache():
+    """Delete the least recently used cache files while the cache is over
+    CACHE_MAX_BYTES
+
+    Files used within CACHE_TTL are kept, since the in-memory caches may still
+    hand out their paths. Cache hits refresh a file's modification time.
+    """
+    entries = []
+    for directory, _, file_names in os.walk(CACHE_DIR):
+        for file_name in file_names:
+            path = os.path.join(directory, file_name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+    total_size = sum(size for _, size, _ in entries)
+    cutoff = time.time() - CACHE_TTL
+    for mtime, size, path in sorted(entries):
+        if total_size <= CACHE_MAX_BYTES or mtime > cutoff:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        total_size -= size
+
+def extract_ir1_image(tar_stream, local_img_path):
+    """Decompress the IR1 image out of a streamed VISSR tar archive, returns whether it was found"""
+    with tarfile.open(fileobj=tar_stream, mode='r|') as tar:
+        for member in tar:
+            if member.name.endswith("IR1.A.IMG.gz"):
+                # Decompress straight from the archive member, without
+                # extracting the .gz to disk first
+                member_file = tar.extractfile(member)
+                if deflate is None and rapidgzip is None:
+                    # Plain gzip gains nothing from a one-shot call, so stream
+                    # the image out instead of holding it in memory
+                    with gzip.GzipFile(fileobj=member_file) as f_in:
+                        write_atomically(local_img_path, f_in)
+                else:
+                    write_atomically(local_img_path, gunzip(member_file.read()))
+
+                return True
+
+    return False
+
+def satellite_for_time(request_time):
+    """Satellite covering a time and its FTP base path, or (None, None) outside
+    the archive"""
+    if GMS5_START_DATE <= request_time <= GMS5_END_DATE:
+        return "GMS5", "/pub/GMS5/VISSR"
+    if GOES9_START_DATE <= request_time <= GOES9_END_DATE:
+        return "GOES9", "/pub/GOES9-Pacific/VISSR"
+    return None, None
+
+@st.cache_data(ttl=CACHE_TTL, show_spinner=False)
+def fetch_file(year, month, day, hour, _progress=None, _cancel=None):
+    """Fetch satellite file from FTP server, returns (path, satellite, error)
+
+    Runs off the script thread, so progress is reported through the optional
+    _progress(value, text) callback rather than Streamlit elements. Setting the
+    optional _cancel event aborts the download with FetchCancelled, which is
+    raised rather than returned so the aborted result is not cached.
+    """
+    return fetch_to_disk_cache(year, month, day, hour, _progress, _cancel)
+
+def fetch_to_disk_cache(year, month, day, hour, progress=None, cancel=None):
+    """Fetch satellite file into the disk cache without memoizing the result,
+    for callers such as prefetching that must not cache a failure"""
+    def report_progress(value, text):
+        if progress is not None:
+            progress(value, text)
+    
+    try:
+        satellite, ftp_base_path = satellite_for_time(datetime(year, month, day, hour))
+        if satellite is None:
             return None, None, "The requested date is out of this dataset's period of coverage!"
 
         ftp_dir = f"{ftp_base_path}/{year}{month:02d}/{day:02d}"
         file_name = f"VISSR_{satellite}_{year}{month:02d}{day:02d}{hour:02d}00.tar"
-        local_tar_path = os.path.join(temp_dir, file_name)
 
-        progress_bar = st.progress(0)
-        status_text = st.empty()
-        status_text.text("Connecting to FTP server...")
+        # Decoded images are kept in a cache directory on disk, under the
+        # filename that Satpy expects, so a repeat request skips the FTP
+        # download and extraction entirely, even after a restart
+        cache_dir = os.path.join(CACHE_DIR, satellite)
+        satpy_filename = f"VISSR_{year}{month:02d}{day:02d}_{hour:02d}00_IR1.A.IMG"
+        local_img_path = os.path.join(cache_dir, satpy_filename)
+        if os.path.exists(local_img_path):
+            os.utime(local_img_path)
+            report_progress(100, "Loaded from cache!")
+            return local_img_path, satellite, None
+        os.makedirs(cache_dir, exist_ok=True)
+
+        report_progress(0, "Connecting to FTP server...")
 
         try:
-            with ftplib.FTP(FTP_HOST, timeout=30) as ftp:
-                ftp.login()
-                progress_bar.progress(20)
-                status_text.text("Connected. Navigating to directory...")
+            ftp = acquire_ftp()
+            broken = False
+            try:
+                report_progress(20, "Connected. Navigating to directory...")
                 
                 try:
                     ftp.cwd(ftp_dir)
                 except ftplib.error_perm as e:
                     return None, None, f"Directory not found on FTP server: {e}"
                 
-                progress_bar.progress(40)
-                status_text.text("Downloading file...")
-                
-                with open(local_tar_path, 'wb') as local_file:
+                report_progress(40, "Downloading and extracting file...")
+
+                # Download on a background thread into a pipe while the archive is
+                # unpacked from the other end, so only the final image touches disk.
+                # Closing the pipe once the IR1 member is found stops the download
+                # without fetching the rest of the archive
+                found = False
+                tar_error = None
+                read_fd, write_fd = os.pipe()
+                with ThreadPoolExecutor(max_workers=1) as executor:
+                    download = executor.submit(download_to_pipe, ftp, file_name, write_fd, cancel)
+
+                    with os.fdopen(read_fd, 'rb') as pipe_in:
+                        try:
+                            found = extract_ir1_image(pipe_in, local_img_path)
+                        except tarfile.TarError as e:
+                            tar_error = e
+
+                    # A failed download only shows up above as a broken archive,
+                    # so its own error takes precedence
                     try:
-                        ftp.retrbinary(f"RETR {file_name}", local_file.write)
+                        bytes_downloaded = download.result()
                     except ftplib.error_perm as e:
                         return None, None, f"File not found on FTP server: {e}"
-                
-                progress_bar.progress(60)
-                status_text.text("File downloaded. Extracting...")
+            except BaseException:
+                # The session may be left mid-transfer, so never hand it back
+                broken = True
+                ftp.close()
+                raise
+            finally:
+                if not broken:
+                    release_ftp(ftp)
 
-            # Verify download
-            if not os.path.exists(local_tar_path) or os.path.getsize(local_tar_path) == 0:
+            if bytes_downloaded == 0:
                 return None, None, "Downloaded file is empty or missing"
+            if tar_error is not None:
+                raise tar_error
+            if not found:
+                return None, None, "Could not find IR1.A.IMG.gz file in tar archive"
 
-            progress_bar.progress(80)
-            status_text.text("Extracting archive...")
-
-            # Extract the file
-            with tarfile.open(local_tar_path, 'r') as tar:
-                for member in tar.getmembers():
-                    if member.name.endswith("IR1.A.IMG.gz"):
-                        member.name = os.path.basename(member.name)
-                        tar.extract(member, path=temp_dir)
-                        extracted_path = os.path.join(temp_dir, member.name)
-
-                        # Create the filename that Satpy expects
-                        satpy_filename = f"VISSR_{year}{month:02d}{day:02d}_{hour:02d}00_IR1.A.IMG"
-                        local_img_path = os.path.join(temp_dir, satpy_filename)
-
-                        with gzip.open(extracted_path, 'rb') as f_in:
-                            with open(local_img_path, 'wb') as f_out:
-                                f_out.write(f_in.read())
-
-                        progress_bar.progress(100)
-                        status_text.text("Processing complete!")
-                        return local_img_path, satellite, None
-
-            return None, None, "Could not find IR1.A.IMG.gz file in tar archive"
+            report_progress(100, "Processing complete!")
+            return local_img_path, satellite, None
 
+        except FetchCancelled:
+            raise
         except ftplib.all_errors as e:
             return None, None, f"FTP error: {e}"
         except tarfile.TarError as e:
@@ -278,13 +768,52 @@ def fetch_file(year, month, day, hour):
         except Exception as e:
             return None, None, f"Unexpected error: {e}"
 
+    except FetchCancelled:
+        raise
     except Exception as e:
         return None, None, f"General error in fetch_file: {e}"
 
+def render_cache_path(satellite, year, month, day, hour):
+    """Path of the rendered JPEG for a satellite hour in the disk cache"""
+    key = repr((RENDER_VERSION, RENDER_FLOAT_STRETCH, satellite, year, month, day, hour)).encode()
+    return os.path.join(CACHE_DIR, "renders", f"{hashlib.sha1(key).hexdigest()}.jpg")
+
+def read_cached_render(satellite, year, month, day, hour):
+    """Rendered JPEG bytes for a satellite hour from the disk cache, or None"""
+    render_path = render_cache_path(satellite, year, month, day, hour)
+    try:
+        with open(render_path, 'rb') as f:
+            image_bytes = f.read()
+        os.utime(render_path)
+    except FileNotFoundError:
+        return None
+    return image_bytes
+
+@st.cache_data(ttl=CACHE_TTL, max_entries=20, show_spinner=False)
 def process_and_plot(file_path, satellite, year, month, day, hour):
-    """Process and plot the satellite data"""
-    temp_dir = os.path.dirname(file_path)
-    
+    """Process and plot the satellite data, returns the rendered JPEG bytes
+
+    Rendering is deterministic in its inputs, so results are cached in memory
+    and also kept in the disk cache, where they survive restarts.
+    """
+    image_bytes = read_cached_render(satellite, year, month, day, hour)
+    if image_bytes is not None:
+        return image_bytes
+
+    image_bytes, calibrated = render_image(file_path, satellite, year, month, day, hour)
+
+    # Renders from the manual fallback only approximate the calibration, so
+    # keep them off disk and let a later run try Satpy again
+    if calibrated:
+        render_path = render_cache_path(satellite, year, month, day, hour)
+        os.makedirs(os.path.dirname(render_path), exist_ok=True)
+        write_atomically(render_path, image_bytes)
+    return image_bytes
+
+def render_image(file_path, satellite, year, month, day, hour):
+    """Read the satellite file and render it to JPEG bytes, returns them and
+    whether they came from Satpy's calibrated data rather than the manual
+    fallback"""
     try:
         # Apply comprehensive patches
         comprehensive_patch_gms5_reader()
@@ -300,6 +829,7 @@ def process_and_plot(file_path, satellite, year, month, day, hour):
             scene.load(["IR1"])
             ir1_data = scene["IR1"]
             satellite_name = ir1_data.attrs.get('platform', satellite)
+            calibrated = True
             print("Successfully loaded with Satpy")
 
         except Exception as e:
@@ -313,77 +843,113 @@ def process_and_plot(file_path, satellite, year, month, day, hour):
                 raise ValueError("Both Satpy and manual reading failed")
 
             satellite_name = satellite
+            calibrated = False
             print("Successfully loaded with manual method")
 
-        # Process the data
-        kelvin_values = ir1_data.values
-        celsius_values = kelvin_values - 273.15
-
-        # Apply vertical stretch
-        if VERTICAL_STRETCH != 1.0:
-            original_height, original_width = celsius_values.shape
-            celsius_values = ndimage.zoom(celsius_values, (VERTICAL_STRETCH, 1.0), order=1)
-
-        # Create visualization
-        custom_cmap = create_colormap()
-        vmin = -100
-        vmax = 40
-
-        fig, ax = plt.subplots(figsize=(12, 10), dpi=300)
-        ax.imshow(celsius_values, cmap=custom_cmap, vmin=vmin, vmax=vmax)
-
-        ax.grid(False)
-        ax.axis('off')
-        ax.set_xticks([])
-        ax.set_yticks([])
-
-        # Remove all borders
-        ax.spines['top'].set_visible(False)
-        ax.spines['right'].set_visible(False)
-        ax.spines['bottom'].set_visible(False)
-        ax.spines['left'].set_visible(False)
-
-        # Save the plot
-        plot_path = os.path.join(temp_dir, 'satellite_data_plot.jpg')
-        plt.savefig(plot_path, format='jpg', dpi=300, bbox_inches='tight', pad_inches=0)
-        plt.close()
-
-        # Open the saved image and stretch it sideways by 75%
-        img = Image.open(plot_path)
-        width, height = img.size
-        new_width = int(width * 1.75)
-        img = img.resize((new_width, height), Image.LANCZOS)
-
-        # Add watermarks
+        # Process the data. Raw counts from manual reading index their own
+        # table directly. Calibrated temperatures are binned onto the colormap
+        # before the stretch, so the resample moves one byte per pixel instead
+        # of a float32; RENDER_FLOAT_STRETCH keeps them as float32 through it
+        values = ir1_data.values
+        missing = None
+        if values.dtype == np.uint8:
+            lut = COUNTS_LUT
+        else:
+            # Missing pixels are painted white after coloring, the way
+            # matplotlib drew them against the figure background
+            missing = np.isnan(values)
+            if not missing.any():
+                missing = None
+            if not RENDER_FLOAT_STRETCH:
+                values = temperatures_to_indices(values)
+            else:
+                values = values.astype(np.float32, copy=False)
+            lut = COLORMAP_LUT
+
+        # Apply the vertical and sideways stretch in a single resample, before
+        # coloring so it only has to move one channel. It goes straight to the
+        # output size, which is never larger than the original matplotlib figure
+        stretched_height = values.shape[0] * VERTICAL_STRETCH
+        stretched_width = values.shape[1] * HORIZONTAL_STRETCH
+        scale = min(1.0, OUTPUT_MAX_WIDTH / stretched_width, OUTPUT_MAX_HEIGHT / stretched_height)
+        new_height = int(round(stretched_height * scale))
+        new_width = int(round(stretched_width * scale))
+        if (new_height, new_width) != values.shape:
+            # cv2.resize takes the target size as (width, height)
+            stretched = np.empty((new_height, new_width), dtype=values.dtype)
+            cv2.resize(
+                values, (new_width, new_height), dst=stretched, interpolation=cv2.INTER_LINEAR
+            )
+            values = stretched
+            if missing is not None:
+                missing = cv2.resize(
+                    missing.view(np.uint8), (new_width, new_height), interpolation=cv2.INTER_NEAREST
+                ).view(bool)
+
+        # Color the image through a 256-entry RGB lookup table instead of
+        # normalizing and colormapping every pixel
+        if values.dtype != np.uint8:
+            values = temperatures_to_indices(values)
+        rgb_values = apply_lut(values, lut)
+        if missing is not None:
+            rgb_values[missing] = 255
+
+        # Build the image straight from the RGB array
+        img = Image.fromarray(rgb_values)
+        height = img.height
+
+        # Add watermarks, sized relative to the full-size output image
         draw = ImageDraw.Draw(img)
-        
-        try:
-            font = ImageFont.truetype("arial.ttf", 50)
-        except:
-            font = ImageFont.load_default()
-        
+        watermark_scale = height / OUTPUT_MAX_HEIGHT
+        font = load_font(max(1, round(WATERMARK_FONT_SIZE * watermark_scale)))
+        bottom_offset = round(WATERMARK_BOTTOM_OFFSET * watermark_scale)
+
         watermark_text_top = f"{satellite_name} Data for {year}-{month:02d}-{day:02d} at {hour:02d}:00 UTC"
         watermark_text_bottom = "Plotted by Sekai Chandra @Sekai_WX"
-        draw.text((10, 10), watermark_text_top, fill="white", font=font)
-        draw.text((10, height - 70), watermark_text_bottom, fill="red", font=font)
+        draw.text((10, 10), watermark_text_top, fill="white", font=font, anchor='la')
+        draw.text((10, height - bottom_offset), watermark_text_bottom, fill="red", font=font, anchor='la')
 
-        # Save the final image
-        final_image_path = os.path.join(temp_dir, 'final_satellite_data_plot.jpg')
-        img.save(final_image_path)
+        # Encode the final image in memory
+        output = io.BytesIO()
+        img.save(output, 'JPEG', quality=75, subsampling=2, optimize=False, progressive=False)
 
-        return final_image_path
+        return output.getvalue(), calibrated
 
     except Exception as e:
         raise e
-    finally:
-        # Clean up files safely
-        try:
-            if os.path.exists(file_path):
-                os.remove(file_path)
-            if temp_dir and os.path.exists(temp_dir):
-                shutil.rmtree(temp_dir, ignore_errors=True)
-        except:
-            pass
+
+@st.cache_resource
+def get_executor():
+    """Thread pool shared by all sessions for the fetches they are waiting on"""
+    return ThreadPoolExecutor(max_workers=4)
+
+@st.cache_resource
+def get_prefetch_executor():
+    """Single worker shared by all sessions for speculative prefetches, kept
+    apart from get_executor so they never hold up a fetch someone is waiting on.
+    Returns the executor and a semaphore limiting how many prefetches queue up"""
+    return ThreadPoolExecutor(max_workers=1), threading.BoundedSemaphore(PREFETCH_MAX_QUEUED)
+
+def prefetch_neighbours(year, month, day, hour):
+    """Warm the disk cache for the hours either side of the one shown
+
+    Users tend to step through neighbouring hours, so download those in the
+    background while the current image is being looked at. Prefetches beyond
+    PREFETCH_MAX_QUEUED are dropped rather than queued.
+    """
+    executor, slots = get_prefetch_executor()
+    current = datetime(year, month, day, hour)
+    for neighbour in (current - timedelta(hours=1), current + timedelta(hours=1)):
+        if not GMS5_START_DATE <= neighbour <= GOES9_END_DATE:
+            continue
+        if not slots.acquire(blocking=False):
+            return
+        # Only the disk cache is filled, so a failed prefetch leaves nothing
+        # behind for the user's own request to trip over
+        prefetch = executor.submit(
+            fetch_to_disk_cache, neighbour.year, neighbour.month, neighbour.day, neighbour.hour
+        )
+        prefetch.add_done_callback(lambda _: slots.release())
 
 def main():
     st.set_page_config(
@@ -434,38 +1000,76 @@ def main():
     if generate_clicked:
         with st.spinner("Processing satellite data..."):
             start_time = time.time()
-            
-            final_image_path, satellite_used, error_message = fetch_file(
-                year, month, day, hour
-            )
-            
-            if error_message:
-                st.error(f"Error: {error_message}")
-            elif final_image_path:
+
+            # An hour that has been rendered before is served straight from the
+            # disk cache, without fetching the satellite file again
+            try:
+                satellite_used, _ = satellite_for_time(datetime(year, month, day, hour))
+            except ValueError:
+                satellite_used = None
+            image_bytes = None
+            if satellite_used is not None:
+                image_bytes = read_cached_render(satellite_used, year, month, day, hour)
+
+            if image_bytes is None:
+                progress_bar = st.progress(0)
+                status_text = st.empty()
+
+                # Fetch on a worker thread and poll it, so the script thread stays
+                # free to update the progress bar. If the user reruns the app the
+                # polling loop is interrupted and the abandoned download cancelled
+                progress = [0, ""]
+                cancel = threading.Event()
+
+                def on_progress(value, text):
+                    progress[:] = [value, text]
+
+                future = get_executor().submit(
+                    fetch_file, year, month, day, hour, _progress=on_progress, _cancel=cancel
+                )
                 try:
-                    processed_image_path = process_and_plot(
-                        final_image_path, satellite_used, year, month, day, hour
-                    )
-                    
-                    processing_time = time.time() - start_time
-                    st.success(f"Image generated successfully in {processing_time:.1f} seconds using {satellite_used}!")
-                    
-                    # Display the image
-                    st.image(processed_image_path, caption=f"{satellite_used} Satellite Data - {year}-{month:02d}-{day:02d} {hour:02d}:00 UTC")
-                    
-                    # Provide download button
-                    with open(processed_image_path, "rb") as file:
-                        st.download_button(
-                            label="Download Image",
-                            data=file.read(),
-                            file_name=f"{satellite_used}_{year}{month:02d}{day:02d}_{hour:02d}00_UTC.jpg",
-                            mime="image/jpeg"
+                    while not future.done():
+                        progress_bar.progress(progress[0])
+                        status_text.text(progress[1])
+                        time.sleep(0.1)
+                finally:
+                    if not future.done():
+                        # Drop the fetch if it is still queued, or abort it if running
+                        future.cancel()
+                        cancel.set()
+
+                progress_bar.progress(progress[0])
+                status_text.text(progress[1])
+                final_image_path, satellite_used, error_message = future.result()
+
+                if error_message:
+                    st.error(f"Error: {error_message}")
+                elif final_image_path:
+                    try:
+                        image_bytes = process_and_plot(
+                            final_image_path, satellite_used, year, month, day, hour
                         )
-                        
-                except Exception as e:
-                    st.error(f"Error processing image: {e}")
-            else:
-                st.error("Failed to generate image. Please try again.")
+                    except Exception as e:
+                        st.error(f"Error processing image: {e}")
+                else:
+                    st.error("Failed to generate image. Please try again.")
+
+            if image_bytes is not None:
+                processing_time = time.time() - start_time
+                st.success(f"Image generated successfully in {processing_time:.1f} seconds using {satellite_used}!")
+
+                # Display the image
+                st.image(image_bytes, caption=f"{satellite_used} Satellite Data - {year}-{month:02d}-{day:02d} {hour:02d}:00 UTC")
+
+                # Provide download button
+                st.download_button(
+                    label="Download Image",
+                    data=image_bytes,
+                    file_name=f"{satellite_used}_{year}{month:02d}{day:02d}_{hour:02d}00_UTC.jpg",
+                    mime="image/jpeg"
+                )
+
+                prefetch_neighbours(year, month, day, hour)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file